@@ -1,10 +1,7 @@
-import socket
-import threading
+import asyncio
 import sys
 import time
 import platform
-import datetime
-import json
 import random
 from kivy.app import App
 from kivy.uix.boxlayout import BoxLayout
@@ -17,13 +14,11 @@ from kivy.uix.widget import Widget
 from kivy.clock import Clock
 from kivy.core.window import Window
 from kivy.utils import get_color_from_hex
+from core import Client
 
 Window.clearcolor = get_color_from_hex("#121212")
 Window.size = (400, 600)
 
-SERVER_IP = 'IP_SERVER'
-PORT = 5555
-
 IS_ANDROID = False
 try:
     from jnius import autoclass
@@ -44,233 +39,10 @@ def show_toast(message):
     else:
         print(f"💬 [TOAST] {message}")
 
-class Client:
-    def __init__(self):
-        self.client = None
-        self.connected = False
-        self.username = None
-        self.display_name = None
-        self.in_chat = False
-        self.chat_partner = None
-        self.receive_thread = None
-        self.pending_invite = None
-        self.chat_history = []
-        self.last_ping = 0
-        self.ping_time = 0
-        self.start_time = time.time()
-        self.status = "🟢 В сети"
-        self.contacts = []
-        self.password = None
-        self.callbacks = []
-        self.lock = threading.Lock()
-        self.connect_to_server()
-        self.start_receive_thread()
-        self.start_ping_thread()
-
-    def connect_to_server(self):
-        try:
-            self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client.settimeout(10)
-            self.client.connect((SERVER_IP, PORT))
-            self.connected = True
-            self.status = "🟢 В сети"
-            return True
-        except Exception as e:
-            self.connected = False
-            self.status = "🔴 Отключен"
-            self.trigger_callback('show_error', f"Нет подключения: {str(e)}")
-            return False
-
-    def start_receive_thread(self):
-        if self.receive_thread is None or not self.receive_thread.is_alive():
-            self.receive_thread = threading.Thread(target=self.receive_messages, daemon=True)
-            self.receive_thread.start()
-
-    def start_ping_thread(self):
-        def ping():
-            while True:
-                time.sleep(5)
-                if not self.connected:
-                    continue
-                try:
-                    self.last_ping = time.time()
-                    self.send('PING:')
-                except:
-                    self.connected = False
-                    self.status = "🔴 Отключен"
-                    break
-        thread = threading.Thread(target=ping, daemon=True)
-        thread.start()
-
-    def receive_messages(self):
-        buffer = ""
-        while True:
-            if not self.connected:
-                time.sleep(1)
-                continue
-            try:
-                data = self.client.recv(1024).decode('utf-8', errors='ignore')
-                if not data:
-                    break
-                buffer += data
-                while '\n' in buffer:
-                    line, buffer = buffer.split('\n', 1)
-                    line = line.strip()
-                    if line:
-                        self.handle_message(line)
-            except Exception as e:
-                self.connected = False
-                self.trigger_callback('show_error', "Соединение потеряно")
-                break
-
-    def handle_message(self, message):
-        if not message:
-            return
-        parts = message.split(':', 2)
-        command = parts[0]
-
-        if command == 'SUCCESS':
-            if parts[1].startswith('Logged in'):
-                self.display_name = parts[2] if len(parts) > 2 else self.username
-                self.send('GET_CONTACTS:')
-            self.trigger_callback('show_success', parts[1])
-
-        elif command in ('ERROR', 'NOT_FOUND', 'REJECTED'):
-            msg = parts[1] if len(parts) > 1 else "Ошибка"
-            self.trigger_callback('show_error', msg)
-
-        elif command == 'FOUND':
-            user = parts[1] if len(parts) > 1 else "неизвестный"
-            display = parts[2] if len(parts) > 2 else user
-            self.trigger_callback('show_found', user, display)
-
-        elif command == 'INVITE':
-            if len(parts) >= 3:
-                self.pending_invite = (parts[1], parts[2])
-                self.trigger_callback('show_invite', parts[1], parts[2])
-
-        elif command == 'CHAT_START':
-            self.in_chat = True
-            self.chat_partner = parts[1] if len(parts) > 1 else "Собеседник"
-            self.chat_history = []
-            self.trigger_callback('start_chat', self.chat_partner)
-
-        elif command == 'CHAT_END':
-            reason = parts[1] if len(parts) > 1 else "Чат завершён"
-            self.in_chat = False
-            self.trigger_callback('show_notification', reason)
-            self.trigger_callback('show_chat_menu')
-
-        elif command == 'MESSAGE':
-            sender = parts[1] if len(parts) > 1 else "Аноним"
-            text = parts[2] if len(parts) > 2 else ""
-            self.add_message_to_history(sender, text)
-
-        elif command == 'TYPING':
-            self.trigger_callback('show_typing', True)
-            Clock.schedule_once(lambda dt: self.trigger_callback('show_typing', False), 1.2)
-
-        elif command == 'PONG':
-            self.ping_time = int((time.time() - self.last_ping) * 1000)
-
-        elif command == 'CONTACTS':
-            raw_data = parts[1] if len(parts) > 1 else "[]"
-            try:
-                contacts = json.loads(raw_data)
-                self.contacts = contacts
-                self.trigger_callback('update_contacts', self.contacts)
-            except Exception as e:
-                self.trigger_callback('show_error', f"Контакты: ошибка ({str(e)})")
-
-    def add_message_to_history(self, sender, text):
-        timestamp = datetime.datetime.now().strftime("%H:%M")
-        color = "#00aaff" if sender == self.display_name else "#ffffff"
-        align = "right" if sender == self.display_name else "left"
-        bubble_color = "#00aaff" if sender == self.display_name else "#2d2d2d"
-        name = "Вы" if sender == self.display_name else sender
-        msg_html = (
-            f'[color={color}][b]{name}[/b] • {timestamp}[/color]\n'
-            f'[ref={sender}]'
-            f'[size=14][b][color=black]{text}[/color][/b][/size]'
-            f'[/ref]\n'
-        )
-        with self.lock:
-            self.chat_history.append((msg_html, align, bubble_color))
-            self.chat_history = self.chat_history[-100:]
-        self.trigger_callback('update_chat', self.chat_history)
-
-    def trigger_callback(self, event, *args):
-        def call(dt):
-            for cb in self.callbacks:
-                if cb['event'] == event:
-                    try:
-                        cb['func'](*args)
-                    except Exception as e:
-                        print(f"Callback error: {e}")
-        Clock.schedule_once(call, 0)
-
-    def send(self, msg):
-        if self.connected:
-            try:
-                self.client.send((msg + '\n').encode('utf-8'))
-            except Exception as e:
-                self.connected = False
-                self.trigger_callback('show_error', "Ошибка отправки")
-
-    def register(self, username, password, display_name):
-        if username and password:
-            self.send(f'REGISTER:{username}:{password}:{display_name or username}')
-
-    def login(self, username, password):
-        self.username = username
-        self.password = password
-        if username and password:
-            self.send(f'LOGIN:{username}:{password}')
-
-    def send_message(self, text):
-        if self.in_chat and text.strip():
-            self.send(f'MESSAGE:{text}')
-
-    def invite_user(self, target):
-        if target:
-            self.send(f'INVITE:{target}')
-
-    def find_user(self, target):
-        if target:
-            self.send(f'FIND:{target}')
-
-    def add_contact(self, username):
-        if username:
-            self.send(f'ADD_CONTACT:{username}')
-
-    def remove_contact(self, username):
-        if username:
-            self.send(f'REMOVE_CONTACT:{username}')
-
-    def respond_invite(self, response, username):
-        if username:
-            self.send(f'RESPONSE:{response}:{username}')
-
-    def change_password(self, old, new, confirm):
-        if new == confirm:
-            self.send(f'CHANGE_PASSWORD:{old}:{new}:{confirm}')
-        else:
-            self.trigger_callback('show_error', "Пароли не совпадают")
-
-    def logout(self):
-        if self.connected:
-            try:
-                self.send('EXIT:')
-            except:
-                pass
-        self.in_chat = False
-        self.username = None
-        self.display_name = None
-        self.trigger_callback('show_main_menu')
-
 class MessengerApp(App):
     def build(self):
         self.client = Client()
+        self.client_task = asyncio.get_running_loop().create_task(self.client.run())
         self.layout = BoxLayout(orientation='vertical', padding=10, spacing=8)
         if IS_ANDROID:
             request_permissions([Permission.INTERNET, Permission.ACCESS_NETWORK_STATE])
@@ -278,6 +50,16 @@ class MessengerApp(App):
         self.create_main_menu()
         return self.layout
 
+    def on_stop(self):
+        self.client_task.cancel()
+
+    def on_pause(self):
+        self.client.set_background(True)
+        return True
+
+    def on_resume(self):
+        self.client.set_background(False)
+
     def update_status(self, dt):
         children = self.layout.children
         for child in children:
@@ -295,9 +77,10 @@ class MessengerApp(App):
         self.add_button("🔑 Вход", self.show_login, bg="#0088ff")
         self.add_button("⚙️ Настройки", self.show_settings, bg="#555555")
         self.add_button("🚪 Выход", lambda x: App.get_running_app().stop(), bg="#ff3333")
-        self.client.callbacks = [cb for cb in self.client.callbacks if cb['event'] not in ('show_success', 'show_error', 'show_main_menu')]
+        self.client.callbacks = [cb for cb in self.client.callbacks if cb['event'] not in ('show_success', 'show_error', 'show_notification', 'show_main_menu')]
         self.add_callback('show_success', self.show_success)
         self.add_callback('show_error', self.show_error)
+        self.add_callback('show_notification', self.show_notification)
         self.add_callback('show_main_menu', self.create_main_menu)
 
     def label(self, text, font_size=16, color="#ffffff", height=None):
@@ -368,7 +151,14 @@ class MessengerApp(App):
         self.layout.clear_widgets()
         self.layout.add_widget(self.label("ℹ️ ИНФОРМАЦИЯ", font_size=20, color="#00aaff"))
         uptime = int(time.time() - self.client.start_time)
-        info = f"📶 Пинг: {self.client.ping_time} мс\n⏱ В сети: {uptime} сек"
+        latency = self.client.latency
+        info = (
+            f"📶 Пинг: {self.client.ping_time} мс\n"
+            f"📈 Среднее: {int(latency.ewma or 0)} мс | Джиттер: {int(latency.jitter)} мс\n"
+            f"📊 p50: {latency.percentile(50)} мс | p95: {latency.percentile(95)} мс\n"
+            f"📉 Потеряно: {latency.lost}\n"
+            f"⏱ В сети: {uptime} сек"
+        )
         self.layout.add_widget(self.label(info, font_size=14, color="#bbbbbb"))
         self.add_button("⬅️ Назад", self.show_settings, bg="#555555")
 
@@ -462,6 +252,7 @@ class MessengerApp(App):
             foreground_color=get_color_from_hex("#ffffff")
         )
         self.message_input.bind(on_text_validate=self.send_message)
+        self.message_input.bind(text=self.on_message_text)
         self.layout.add_widget(self.message_input)
         self.add_button("🚪 Выйти из чата", self.exit_chat, bg="#ff3333")
         self.add_callback('update_chat', self.update_chat_display)
@@ -473,6 +264,8 @@ class MessengerApp(App):
             bubble_style = f'background-color: {color}; padding: 10px; margin: 4px; border-radius: 12px; max-width: 70%'
             content += f'[b][align={align}][{bubble_style}]{msg}[/align][/b]\n'
         self.chat_output.text = content
+        if self.client.partner_typing:
+            self.show_typing_indicator(True)
 
     def show_typing_indicator(self, active):
         if active:
@@ -481,6 +274,10 @@ class MessengerApp(App):
             lines = self.chat_output.text.split('\n')
             self.chat_output.text = '\n'.join([l for l in lines if "печатает" not in l])
 
+    def on_message_text(self, instance, value):
+        if value:
+            self.client.notify_typing()
+
     def send_message(self, instance):
         text = instance.text.strip()
         if text:
@@ -500,5 +297,8 @@ class MessengerApp(App):
     def show_error(self, message):
         show_toast(f"❌ {message}")
 
+    def show_notification(self, message):
+        show_toast(f"🔔 {message}")
+
 if __name__ == "__main__":
-    MessengerApp().run()
+    asyncio.run(MessengerApp().async_run(async_lib='asyncio'))
@@ -0,0 +1,481 @@
+import asyncio
+import time
+import datetime
+import json
+from collections import deque
+
+SERVER_IP = 'IP_SERVER'
+PORT = 5555
+READ_LIMIT = 4 * 1024 * 1024
+
+PING_INTERVAL = 5
+PING_INTERVAL_FLAKY = 2
+PING_INTERVAL_IDLE = 30
+PING_INTERVAL_BACKGROUND = 120
+PING_TIMEOUT = 10
+PING_MAX_LOST = 3
+IDLE_AFTER = 60
+
+RECONNECT_MIN = 1
+RECONNECT_MAX = 30
+
+ACK_DELAY = 0.5
+ACK_BATCH = 20
+
+TYPING_IDLE = 3
+TYPING_TIMEOUT = 30
+
+class LatencyStats:
+    def __init__(self, window=50):
+        self.samples = deque(maxlen=window)
+        self.ewma = None
+        self.jitter = 0.0
+        self.lost = 0
+        self.loss_streak = 0
+
+    def add(self, rtt):
+        self.samples.append(rtt)
+        self.loss_streak = 0
+        if self.ewma is None:
+            self.ewma = rtt
+            self.jitter = rtt / 2
+        else:
+            self.jitter += (abs(rtt - self.ewma) - self.jitter) / 4
+            self.ewma += (rtt - self.ewma) / 8
+
+    def add_loss(self):
+        self.lost += 1
+        self.loss_streak += 1
+
+    def percentile(self, p):
+        if not self.samples:
+            return 0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    def is_flaky(self):
+        if self.loss_streak:
+            return True
+        return self.ewma is not None and len(self.samples) >= 5 and self.jitter > self.ewma / 2
+
+class Client:
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.loop = None
+        self.outbox = None
+        self.tasks = []
+        self.connected = False
+        self.username = None
+        self.display_name = None
+        self.in_chat = False
+        self.chat_partner = None
+        self.pending_invite = None
+        self.chat_history = []
+        self.histories = {}
+        self.ping_seq = 0
+        self.pending_pings = {}
+        self.ping_time = 0
+        self.latency = LatencyStats()
+        self.last_activity = time.time()
+        self.in_background = False
+        self.ping_wakeup = None
+        self.delivery_user = None
+        self.server_epoch = None
+        self.received_seqs = {}
+        self.pending_acks = {}
+        self.unacked_count = 0
+        self.ack_timer = None
+        self.typing_sent = {}
+        self.typing_idle_timer = None
+        self.partner_typing = False
+        self.typing_timer = None
+        self.start_time = time.time()
+        self.status = "🔴 Отключен"
+        self.contacts = []
+        self.password = None
+        self.callbacks = []
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.ping_wakeup = asyncio.Event()
+        delay = RECONNECT_MIN
+        while True:
+            if await self.connect_to_server(notify=delay == RECONNECT_MIN):
+                delay = RECONNECT_MIN
+                self.tasks = [
+                    asyncio.create_task(self.write_loop()),
+                    asyncio.create_task(self.ping_loop()),
+                ]
+                if self.username and self.password:
+                    self.send(f'LOGIN:{self.username}:{self.password}', activity=False)
+                try:
+                    await self.read_loop()
+                finally:
+                    self.close()
+                if self.in_chat:
+                    self.end_chat("Соединение потеряно")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX)
+
+    async def connect_to_server(self, notify=True):
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(SERVER_IP, PORT, limit=READ_LIMIT), timeout=10)
+            self.outbox = asyncio.Queue()
+            self.pending_pings = {}
+            self.latency.loss_streak = 0
+            self.connected = True
+            self.status = "🟢 В сети"
+            return True
+        except Exception as e:
+            self.connected = False
+            self.status = "🔴 Отключен"
+            if notify:
+                self.trigger_callback('show_error', f"Нет подключения: {str(e)}")
+            return False
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        self.connected = False
+        self.status = "🔴 Отключен"
+
+    async def read_loop(self):
+        try:
+            while True:
+                data = await self.reader.readline()
+                if not data:
+                    break
+                line = data.decode('utf-8', errors='ignore').strip()
+                if not line:
+                    continue
+                try:
+                    self.handle_message(line)
+                except Exception as e:
+                    print(f"Handler error: {e}")
+        except (ConnectionError, OSError):
+            pass
+        except ValueError as e:
+            print(f"Read error: {e}")
+        if self.connected and self.username:
+            self.trigger_callback('show_error', "Соединение потеряно")
+
+    async def write_loop(self):
+        try:
+            while True:
+                batch = [await self.outbox.get()]
+                while not self.outbox.empty():
+                    batch.append(self.outbox.get_nowait())
+                self.writer.write(''.join(msg + '\n' for msg in batch).encode('utf-8'))
+                await self.writer.drain()
+        except (ConnectionError, OSError):
+            self.trigger_callback('show_error', "Ошибка отправки")
+            self.close()
+
+    async def ping_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.ping_wakeup.wait(), timeout=self.ping_interval())
+            except asyncio.TimeoutError:
+                pass
+            self.ping_wakeup.clear()
+            self.expire_pings()
+            if self.latency.loss_streak >= PING_MAX_LOST:
+                self.trigger_callback('show_error', "Соединение потеряно")
+                self.close()
+                return
+            self.ping_seq += 1
+            self.pending_pings[self.ping_seq] = time.time()
+            self.send(f'PING:{self.ping_seq}', activity=False)
+
+    def ping_interval(self):
+        if self.in_background:
+            return PING_INTERVAL_BACKGROUND
+        if self.latency.is_flaky():
+            return PING_INTERVAL_FLAKY
+        if time.time() - self.last_activity > IDLE_AFTER:
+            return PING_INTERVAL_IDLE
+        return PING_INTERVAL
+
+    def expire_pings(self):
+        deadline = time.time() - PING_TIMEOUT
+        for tag, sent in list(self.pending_pings.items()):
+            if sent < deadline:
+                del self.pending_pings[tag]
+                self.latency.add_loss()
+
+    def handle_pong(self, tag):
+        try:
+            sent = self.pending_pings.pop(int(tag))
+        except (ValueError, KeyError):
+            return
+        self.ping_time = int((time.time() - sent) * 1000)
+        self.latency.add(self.ping_time)
+
+    def set_background(self, background):
+        self.in_background = background
+        if not background:
+            self.last_activity = time.time()
+            if self.ping_wakeup:
+                self.ping_wakeup.set()
+
+    def handle_message(self, message):
+        if not message:
+            return
+        parts = message.split(':', 2)
+        command = parts[0]
+
+        if command == 'SUCCESS':
+            if parts[1].startswith('Logged in'):
+                self.display_name = parts[2] if len(parts) > 2 else self.username
+                self.send('GET_CONTACTS:')
+                resume = {'epoch': self.server_epoch, 'received': self.received_seqs}
+                self.send(f'RESUME:{json.dumps(resume)}', activity=False)
+            self.trigger_callback('show_success', parts[1])
+
+        elif command in ('ERROR', 'NOT_FOUND', 'REJECTED'):
+            msg = parts[1] if len(parts) > 1 else "Ошибка"
+            self.trigger_callback('show_error', msg)
+
+        elif command == 'FOUND':
+            user = parts[1] if len(parts) > 1 else "неизвестный"
+            display = parts[2] if len(parts) > 2 else user
+            self.trigger_callback('show_found', user, display)
+
+        elif command == 'INVITE':
+            if len(parts) >= 3:
+                self.pending_invite = (parts[1], parts[2])
+                self.trigger_callback('show_invite', parts[1], parts[2])
+
+        elif command == 'CHAT_START':
+            self.in_chat = True
+            self.chat_partner = parts[1] if len(parts) > 1 else "Собеседник"
+            self.chat_history = self.histories.setdefault(self.chat_partner, [])
+            self.reset_typing()
+            self.trigger_callback('start_chat', self.chat_partner)
+
+        elif command == 'CHAT_END':
+            self.end_chat(parts[1] if len(parts) > 1 else "Чат завершён")
+
+        elif command == 'MESSAGE':
+            fields = message.split(':', 4)
+            if len(fields) < 5 or not fields[2].isdigit():
+                return
+            _, partner, seq, sender, text = fields
+            if self.receive_seq(partner, int(seq)):
+                self.add_message_to_history(sender, text)
+
+        elif command == 'TYPING':
+            self.set_partner_typing(len(parts) > 1 and parts[1] == '1')
+
+        elif command == 'RESUMED':
+            epoch = parts[1] if len(parts) > 1 else None
+            if epoch != self.server_epoch:
+                self.server_epoch = epoch
+                self.received_seqs = {}
+                self.pending_acks = {}
+
+        elif command == 'PONG':
+            self.handle_pong(parts[1] if len(parts) > 1 else '')
+
+        elif command == 'CONTACTS':
+            raw_data = message.partition(':')[2] or "[]"
+            try:
+                contacts = json.loads(raw_data)
+                self.contacts = contacts
+                self.trigger_callback('update_contacts', self.contacts)
+            except Exception as e:
+                self.trigger_callback('show_error', f"Контакты: ошибка ({str(e)})")
+
+        elif command == 'CONTACTS_RESULT':
+            try:
+                results = json.loads(message.partition(':')[2])
+            except ValueError:
+                return
+            if not isinstance(results, dict):
+                return
+            changed = sum(1 for result in results.values() if result in ('added', 'removed'))
+            missing = sum(1 for result in results.values() if result in ('not_found', 'self'))
+            self.trigger_callback('show_success', f"Контакты обновлены: {changed}, не найдено: {missing}")
+            self.trigger_callback('update_contacts_result', results)
+
+    def end_chat(self, reason):
+        self.in_chat = False
+        self.reset_typing()
+        self.trigger_callback('show_notification', reason)
+        self.trigger_callback('show_chat_menu')
+
+    def receive_seq(self, partner, seq):
+        fresh = seq > self.received_seqs.get(partner, 0)
+        if fresh:
+            self.received_seqs[partner] = seq
+        self.pending_acks[partner] = self.received_seqs[partner]
+        self.unacked_count += 1
+        if self.unacked_count >= ACK_BATCH:
+            self.flush_acks()
+        elif not self.ack_timer:
+            self.ack_timer = self.loop.call_later(ACK_DELAY, self.flush_acks)
+        return fresh
+
+    def reset_delivery(self):
+        if self.ack_timer:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+        self.server_epoch = None
+        self.received_seqs = {}
+        self.pending_acks = {}
+        self.unacked_count = 0
+
+    def flush_acks(self):
+        if self.ack_timer:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+        for partner, seq in self.pending_acks.items():
+            self.send(f'ACK:{partner}:{seq}', activity=False)
+        self.pending_acks = {}
+        self.unacked_count = 0
+
+    def set_partner_typing(self, active):
+        if self.typing_timer:
+            self.typing_timer.cancel()
+            self.typing_timer = None
+        if active:
+            self.typing_timer = self.loop.call_later(TYPING_TIMEOUT, self.set_partner_typing, False)
+        if self.partner_typing != active:
+            self.partner_typing = active
+            self.trigger_callback('show_typing', active)
+
+    def reset_typing(self):
+        for timer in (self.typing_timer, self.typing_idle_timer):
+            if timer:
+                timer.cancel()
+        self.typing_timer = None
+        self.typing_idle_timer = None
+        self.partner_typing = False
+        self.typing_sent.pop(self.chat_partner, None)
+
+    def add_message_to_history(self, sender, text):
+        timestamp = datetime.datetime.now().strftime("%H:%M")
+        color = "#00aaff" if sender == self.display_name else "#ffffff"
+        align = "right" if sender == self.display_name else "left"
+        bubble_color = "#00aaff" if sender == self.display_name else "#2d2d2d"
+        name = "Вы" if sender == self.display_name else sender
+        msg_html = (
+            f'[color={color}][b]{name}[/b] • {timestamp}[/color]\n'
+            f'[ref={sender}]'
+            f'[size=14][b][color=black]{text}[/color][/b][/size]'
+            f'[/ref]\n'
+        )
+        partner = self.chat_partner if sender == self.display_name else sender
+        history = self.histories.setdefault(partner, [])
+        history.append((msg_html, align, bubble_color))
+        del history[:-100]
+        if self.in_chat and partner == self.chat_partner:
+            self.trigger_callback('update_chat', history)
+        else:
+            self.trigger_callback('show_notification', f"Новое сообщение от {sender}: {text}")
+
+    def trigger_callback(self, event, *args):
+        def call():
+            for cb in self.callbacks:
+                if cb['event'] == event:
+                    try:
+                        cb['func'](*args)
+                    except Exception as e:
+                        print(f"Callback error: {e}")
+        if self.loop:
+            self.loop.call_soon(call)
+        else:
+            call()
+
+    def send(self, msg, activity=True):
+        if activity:
+            self.last_activity = time.time()
+        if self.connected:
+            self.outbox.put_nowait(msg)
+
+    def register(self, username, password, display_name):
+        if username and password:
+            self.send(f'REGISTER:{username}:{password}:{display_name or username}')
+
+    def login(self, username, password):
+        if username != self.delivery_user:
+            self.reset_delivery()
+            self.delivery_user = username
+            self.histories = {}
+            self.chat_history = []
+        self.username = username
+        self.password = password
+        if username and password:
+            self.send(f'LOGIN:{username}:{password}')
+
+    def send_message(self, text):
+        if self.in_chat and text.strip():
+            self.send(f'MESSAGE:{text}')
+
+    def notify_typing(self):
+        if not self.in_chat:
+            return
+        self.send_typing(True)
+        if self.typing_idle_timer:
+            self.typing_idle_timer.cancel()
+        self.typing_idle_timer = self.loop.call_later(TYPING_IDLE, self.send_typing, False)
+
+    def send_typing(self, active=False):
+        if not active and self.typing_idle_timer:
+            self.typing_idle_timer.cancel()
+            self.typing_idle_timer = None
+        if not self.in_chat or self.typing_sent.get(self.chat_partner, False) == active:
+            return
+        self.typing_sent[self.chat_partner] = active
+        self.send(f'TYPING:{int(active)}')
+
+    def invite_user(self, target):
+        if target:
+            self.send(f'INVITE:{target}')
+
+    def find_user(self, target):
+        if target:
+            self.send(f'FIND:{target}')
+
+    def add_contact(self, username):
+        if username:
+            self.send(f'ADD_CONTACT:{username}')
+
+    def remove_contact(self, username):
+        if username:
+            self.send(f'REMOVE_CONTACT:{username}')
+
+    def add_contacts(self, usernames):
+        usernames = [u for u in dict.fromkeys(usernames) if u]
+        if usernames:
+            self.send(f'ADD_CONTACTS:{json.dumps(usernames)}')
+
+    def remove_contacts(self, usernames):
+        usernames = [u for u in dict.fromkeys(usernames) if u]
+        if usernames:
+            self.send(f'REMOVE_CONTACTS:{json.dumps(usernames)}')
+
+    def respond_invite(self, response, username):
+        if username:
+            self.send(f'RESPONSE:{response}:{username}')
+
+    def change_password(self, old, new, confirm):
+        if new == confirm:
+            self.send(f'CHANGE_PASSWORD:{old}:{new}:{confirm}')
+        else:
+            self.trigger_callback('show_error', "Пароли не совпадают")
+
+    def logout(self):
+        self.send('EXIT:')
+        self.in_chat = False
+        self.username = None
+        self.display_name = None
+        self.histories = {}
+        self.chat_history = []
+        self.trigger_callback('show_main_menu')
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import time
+import unittest
+from unittest import mock
+
+import core
+from core import Client, LatencyStats
+
+
+class LatencyStatsTest(unittest.TestCase):
+    def test_first_sample_seeds_estimates(self):
+        stats = LatencyStats()
+        stats.add(100)
+        self.assertEqual(stats.ewma, 100)
+        self.assertEqual(stats.jitter, 50)
+
+    def test_ewma_and_jitter_follow_samples(self):
+        stats = LatencyStats()
+        stats.add(100)
+        stats.add(180)
+        self.assertEqual(stats.ewma, 110)
+        self.assertEqual(stats.jitter, 57.5)
+
+    def test_percentiles_use_rolling_window(self):
+        stats = LatencyStats(window=10)
+        for rtt in range(1, 21):
+            stats.add(rtt)
+        self.assertEqual(list(stats.samples), list(range(11, 21)))
+        self.assertEqual(stats.percentile(50), 16)
+        self.assertEqual(stats.percentile(95), 20)
+        self.assertEqual(LatencyStats().percentile(95), 0)
+
+    def test_loss_streak_marks_flaky_until_next_sample(self):
+        stats = LatencyStats()
+        stats.add(50)
+        stats.add_loss()
+        self.assertTrue(stats.is_flaky())
+        self.assertEqual(stats.lost, 1)
+        stats.add(50)
+        self.assertFalse(stats.is_flaky())
+
+    def test_high_jitter_is_flaky(self):
+        stats = LatencyStats()
+        for rtt in (10, 300, 10, 300, 10, 300):
+            stats.add(rtt)
+        self.assertTrue(stats.is_flaky())
+
+
+class ClientTestCase(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.client = Client()
+        self.client.loop = asyncio.get_running_loop()
+        self.sent = []
+        self.client.send = lambda msg, activity=True: self.sent.append(msg)
+        self.events = []
+        for event in ('show_typing', 'show_notification', 'show_success',
+                      'update_chat', 'update_contacts', 'update_contacts_result'):
+            self.client.callbacks.append({'event': event, 'func': self.recorder(event)})
+
+    def recorder(self, event):
+        return lambda *args: self.events.append((event, args))
+
+    async def settle(self, delay=0):
+        await asyncio.sleep(delay)
+        await asyncio.sleep(0)
+
+    def start_chat(self, partner='Bob'):
+        self.client.display_name = 'Alice'
+        self.client.handle_message(f'CHAT_START:{partner}')
+
+
+class PingTest(ClientTestCase):
+    async def test_out_of_order_pongs_match_their_pings(self):
+        now = time.time()
+        self.client.pending_pings = {1: now - 0.3, 2: now - 0.1}
+        self.client.handle_message('PONG:2')
+        self.assertAlmostEqual(self.client.ping_time, 100, delta=20)
+        self.client.handle_message('PONG:1')
+        self.assertAlmostEqual(self.client.ping_time, 300, delta=20)
+        self.client.handle_message('PONG:1')
+        self.assertEqual(len(self.client.latency.samples), 2)
+
+    async def test_expired_pings_count_as_lost(self):
+        self.client.pending_pings = {1: time.time() - core.PING_TIMEOUT - 1, 2: time.time()}
+        self.client.expire_pings()
+        self.assertEqual(list(self.client.pending_pings), [2])
+        self.assertEqual(self.client.latency.loss_streak, 1)
+
+    async def test_background_backoff_wins_over_flaky(self):
+        self.client.latency.add_loss()
+        self.assertEqual(self.client.ping_interval(), core.PING_INTERVAL_FLAKY)
+        self.client.set_background(True)
+        self.assertEqual(self.client.ping_interval(), core.PING_INTERVAL_BACKGROUND)
+
+    async def test_idle_interval(self):
+        self.client.last_activity = time.time() - core.IDLE_AFTER - 1
+        self.assertEqual(self.client.ping_interval(), core.PING_INTERVAL_IDLE)
+
+
+class DeliveryTest(ClientTestCase):
+    async def test_duplicates_are_dropped(self):
+        self.start_chat()
+        self.client.handle_message('MESSAGE:bob:1:Bob:hi')
+        self.client.handle_message('MESSAGE:bob:1:Bob:hi')
+        self.client.handle_message('MESSAGE:bob:2:Bob:a:b')
+        history = self.client.histories['Bob']
+        self.assertEqual(len(history), 2)
+        self.assertIn('a:b', history[1][0])
+        self.assertEqual(self.client.received_seqs, {'bob': 2})
+
+    async def test_acks_are_batched_after_delay(self):
+        with mock.patch.object(core, 'ACK_DELAY', 0.01):
+            self.client.receive_seq('bob', 1)
+            self.client.receive_seq('bob', 2)
+            self.assertEqual(self.sent, [])
+            await self.settle(0.05)
+        self.assertEqual(self.sent, ['ACK:bob:2'])
+
+    async def test_full_batch_acks_immediately(self):
+        for seq in range(1, core.ACK_BATCH + 1):
+            self.client.receive_seq('bob', seq)
+        self.assertEqual(self.sent, [f'ACK:bob:{core.ACK_BATCH}'])
+        self.assertIsNone(self.client.ack_timer)
+
+    async def test_new_epoch_resets_dedup_state(self):
+        self.client.received_seqs = {'bob': 7}
+        self.client.handle_message('RESUMED:abc')
+        self.assertEqual(self.client.received_seqs, {})
+        self.client.received_seqs = {'bob': 3}
+        self.client.handle_message('RESUMED:abc')
+        self.assertEqual(self.client.received_seqs, {'bob': 3})
+
+    async def test_login_as_other_user_resets_delivery_state(self):
+        self.client.login('alice', 'pw')
+        self.client.received_seqs = {'bob': 5}
+        self.client.server_epoch = 'abc'
+        self.client.login('alice', 'pw')
+        self.assertEqual(self.client.received_seqs, {'bob': 5})
+        self.client.login('carol', 'pw')
+        self.assertEqual(self.client.received_seqs, {})
+        self.assertIsNone(self.client.server_epoch)
+
+    async def test_histories_do_not_leak_across_users(self):
+        self.client.login('alice', 'pw')
+        self.start_chat()
+        self.client.handle_message('MESSAGE:bob:1:Bob:secret')
+        self.client.login('alice', 'pw')
+        self.assertEqual(len(self.client.histories['Bob']), 1)
+        self.client.login('carol', 'pw')
+        self.assertEqual(self.client.histories, {})
+        self.assertEqual(self.client.chat_history, [])
+        self.client.login('alice', 'pw')
+        self.start_chat()
+        self.client.handle_message('MESSAGE:bob:2:Bob:secret')
+        self.client.logout()
+        self.assertEqual(self.client.histories, {})
+        self.assertEqual(self.client.chat_history, [])
+
+    async def test_replay_after_chat_end_is_kept_and_notified(self):
+        self.start_chat()
+        self.client.handle_message('CHAT_END:User disconnected')
+        self.client.handle_message('MESSAGE:bob:1:Bob:missed')
+        await self.settle()
+        self.assertIn(('show_notification', ('Новое сообщение от Bob: missed',)), self.events)
+        self.start_chat()
+        self.assertEqual(len(self.client.chat_history), 1)
+
+
+class TypingTest(ClientTestCase):
+    async def test_burst_sends_one_start_and_one_stop(self):
+        self.start_chat()
+        with mock.patch.object(core, 'TYPING_IDLE', 0.02):
+            for _ in range(10):
+                self.client.notify_typing()
+            self.assertEqual(self.sent, ['TYPING:1'])
+            await self.settle(0.05)
+        self.assertEqual(self.sent, ['TYPING:1', 'TYPING:0'])
+        self.client.send_typing()
+        self.assertEqual(self.sent, ['TYPING:1', 'TYPING:0'])
+
+    async def test_sending_message_stops_typing(self):
+        self.start_chat()
+        self.client.notify_typing()
+        self.client.send_typing()
+        self.assertEqual(self.sent, ['TYPING:1', 'TYPING:0'])
+        self.assertIsNone(self.client.typing_idle_timer)
+
+    async def test_no_typing_outside_chat(self):
+        self.client.notify_typing()
+        self.assertEqual(self.sent, [])
+
+    async def test_partner_indicator_only_on_change(self):
+        self.start_chat()
+        self.client.handle_message('TYPING:1')
+        self.client.handle_message('TYPING:1')
+        self.client.handle_message('TYPING:0')
+        await self.settle()
+        typing = [args for event, args in self.events if event == 'show_typing']
+        self.assertEqual(typing, [(True,), (False,)])
+
+
+class ContactsTest(ClientTestCase):
+    async def test_bulk_requests_deduplicate(self):
+        self.client.add_contacts(['bob', 'bob', '', 'carol'])
+        self.client.remove_contacts([])
+        self.assertEqual(self.sent, ['ADD_CONTACTS:["bob", "carol"]'])
+
+    async def test_contacts_payload_with_colons(self):
+        contacts = [{'username': 'bob', 'display_name': 'Bob: the builder', 'status': 'ONLINE'}]
+        self.client.handle_message(f'CONTACTS:{json.dumps(contacts)}')
+        self.assertEqual(self.client.contacts, contacts)
+
+    async def test_contacts_result_summary(self):
+        results = {'bob': 'added', 'alice': 'self', 'zed': 'not_found', 'carol': 'exists'}
+        self.client.handle_message(f'CONTACTS_RESULT:{json.dumps(results)}')
+        await self.settle()
+        self.assertIn(('update_contacts_result', (results,)), self.events)
+        self.assertIn(('show_success', ("Контакты обновлены: 1, не найдено: 2",)), self.events)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,27 +1,68 @@
 import socket
 import threading
+import selectors
 import json
 import os
+import sys
 import time
+import math
+import base64
+import signal
+import struct
+import subprocess
+import tracemalloc
+import traceback
 import datetime
 import hashlib
 import secrets
+from collections import deque
 
 HOST = 'YOUR_LOCAL_IP'
 PORT = 5555
 USERS_FILE = 'users.json'
 SALT_FILE = 'server.salt'
+UNACKED_WINDOW = 256
+CONTROL_SOCKET = 'server.sock'
+HANDOFF_TIMEOUT = 5
+LOCAL_ADDRESS = ('local', 0)
+PROFILE_DIR = 'profiles'
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+SAMPLE_INTERVAL = 0.005
+Selector = getattr(selectors, 'PollSelector', selectors.DefaultSelector)
 
 class Server:
-    def __init__(self):
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.bind((HOST, PORT))
-        self.server.listen()
+    def __init__(self, takeover=False, bind=True):
+        self.server = None
+        self.control = None
+        self.sessions = {}
+        self.parked = []
+        self.restored = []
+        self.draining = False
+        self.handed_off = False
+        self.handoff_done = threading.Event()
+        self.accept_paused = threading.Event()
+        self.park_lock = threading.Lock()
+        self.drain_r, self.drain_w = socket.socketpair()
+        self.diagnostics = set()
         self.users = {}
         self.active_chats = {}
         self.online_users = {}
+        self.typing = set()
+        self.sequences = {}
+        self.unacked = {}
+        self.delivery_lock = threading.Lock()
+        self.send_locks = {}
+        self.users_lock = threading.RLock()
+        self.epoch = secrets.token_hex(8)
         self.load_salt()
         self.load_users()
+        if takeover:
+            self.take_over()
+        elif bind:
+            self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server.bind((HOST, PORT))
+            self.server.listen()
 
     def log_event(self, event_type, address, details):
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -44,74 +85,182 @@ class Server:
             try:
                 with open(USERS_FILE, 'r') as f:
                     self.users = json.load(f)
+                for user in self.users.values():
+                    user['contacts'] = set(user.get('contacts', []))
             except:
                 self.users = {}
         else:
             self.users = {}
 
     def save_users(self):
-        with open(USERS_FILE, 'w') as f:
-            json.dump(self.users, f)
+        with self.users_lock, open(USERS_FILE, 'w') as f:
+            json.dump(self.users, f, default=sorted)
 
-    def send_contacts(self, username, client):
-        contacts = []
-        if username in self.users:
-            for contact in self.users[username].get('contacts', []):
-                if contact in self.users:
-                    status = 'ONLINE' if contact in self.online_users else 'OFFLINE'
-                    contacts.append({
-                        'username': contact,
-                        'display_name': self.users[contact]['display_name'],
-                        'status': status
-                    })
-        client.send(f'CONTACTS:{json.dumps(contacts)}'.encode('utf-8'))
-
-    def handle_client(self, client, address):
-        current_user = None
-        self.log_event("CONNECT", address, "Client connected")
+    def send(self, client, message):
+        with self.send_locks.setdefault(client, threading.RLock()):
+            client.sendall((message + '\n').encode('utf-8'))
 
+    def read_lines(self, client, session):
+        selector = Selector()
+        selector.register(client, selectors.EVENT_READ)
+        selector.register(self.drain_r, selectors.EVENT_READ)
         try:
             while True:
-                data = client.recv(1024).decode('utf-8')
-                if not data:
-                    break
+                while b'\n' in session['buffer']:
+                    line, session['buffer'] = session['buffer'].split(b'\n', 1)
+                    line = line.decode('utf-8', errors='ignore').strip()
+                    if line:
+                        yield line
+                selector.select()
+                if self.draining:
+                    session['parked'] = True
+                    return
+                chunk = client.recv(1024)
+                if not chunk:
+                    return
+                session['buffer'] += chunk
+        finally:
+            selector.close()
+
+    def deliver(self, sender, target, text):
+        with self.delivery_lock:
+            seq = self.sequences.get((sender, target), 0) + 1
+            self.sequences[(sender, target)] = seq
+            frame = f'MESSAGE:{sender}:{seq}:{self.users[sender]["display_name"]}:{text}'
+            window = self.unacked.setdefault(target, {}).setdefault(sender, deque(maxlen=UNACKED_WINDOW))
+            window.append((seq, frame))
+        try:
+            self.flush(target)
+        except OSError:
+            pass
+        return seq
+
+    def flush(self, username):
+        client = self.online_users.get(username)
+        entry = self.sessions.get(client)
+        if entry is None or not entry[1]['resumed']:
+            return 0
+        session = entry[1]
+        sent = 0
+        with self.send_locks.setdefault(client, threading.RLock()):
+            with self.delivery_lock:
+                frames = [
+                    (sender, seq, frame)
+                    for sender, window in self.unacked.get(username, {}).items()
+                    for seq, frame in window
+                    if seq > session['sent'].get(sender, 0)
+                ]
+            for sender, seq, frame in frames:
+                self.send(client, frame)
+                session['sent'][sender] = seq
+                sent += 1
+        return sent
+
+    def acknowledge(self, sender, target, seq):
+        with self.delivery_lock:
+            window = self.unacked.get(target, {}).get(sender)
+            while window and window[0][0] <= seq:
+                window.popleft()
+            if window is not None and not window:
+                del self.unacked[target][sender]
+
+    def resume(self, username, client, session, received):
+        for sender, seq in received.items():
+            if isinstance(seq, int):
+                self.acknowledge(sender, username, seq)
+        with self.send_locks.setdefault(client, threading.RLock()):
+            self.send(client, f'RESUMED:{self.epoch}')
+            session['resumed'] = True
+            session['sent'] = {}
+        return self.flush(username)
+
+    def update_contacts(self, username, usernames, add):
+        with self.users_lock:
+            contacts = self.users[username]['contacts']
+            results = {}
+            changed = False
+            for contact in dict.fromkeys(usernames):
+                if add:
+                    if contact == username:
+                        results[contact] = 'self'
+                    elif contact not in self.users:
+                        results[contact] = 'not_found'
+                    elif contact in contacts:
+                        results[contact] = 'exists'
+                    else:
+                        contacts.add(contact)
+                        results[contact] = 'added'
+                        changed = True
+                elif contact in contacts:
+                    contacts.discard(contact)
+                    results[contact] = 'removed'
+                    changed = True
+                else:
+                    results[contact] = 'not_found'
+            if changed:
+                self.save_users()
+        return results
+
+    def send_contacts(self, username, client):
+        contacts = []
+        with self.users_lock:
+            names = sorted(self.users[username].get('contacts', ())) if username in self.users else []
+        for contact in names:
+            if contact in self.users:
+                status = 'ONLINE' if contact in self.online_users else 'OFFLINE'
+                contacts.append({
+                    'username': contact,
+                    'display_name': self.users[contact]['display_name'],
+                    'status': status
+                })
+        self.send(client, f'CONTACTS:{json.dumps(contacts)}')
+
+    def handle_client(self, client, address, session):
+        session['parked'] = False
+        current_user = session['user']
 
-                self.log_event("RECEIVE", address, data)
+        try:
+            for data in self.read_lines(client, session):
                 parts = data.split(':', 1)
                 command = parts[0]
+                if command != 'TYPING':
+                    self.log_event("RECEIVE", address, data)
 
                 if command == 'REGISTER':
                     if len(parts) < 2:
-                        client.send('ERROR:Invalid command format'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid command format')
                         continue
 
                     credentials = parts[1].split(':', 2)
                     if len(credentials) < 3:
-                        client.send('ERROR:Invalid data format'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid data format')
                         continue
 
                     username, password, display_name = credentials
-                    if username in self.users:
-                        client.send('ERROR:Username already exists'.encode('utf-8'))
-                    else:
-                        hashed_pw = self.hash_password(password)
-                        self.users[username] = {
-                            'password': hashed_pw,
-                            'display_name': display_name,
-                            'contacts': []
-                        }
-                        self.save_users()
-                        client.send('SUCCESS:Registered successfully'.encode('utf-8'))
+                    hashed_pw = self.hash_password(password)
+                    with self.users_lock:
+                        registered = username not in self.users
+                        if registered:
+                            self.users[username] = {
+                                'password': hashed_pw,
+                                'display_name': display_name,
+                                'contacts': set()
+                            }
+                            self.save_users()
+                    if registered:
+                        self.send(client, 'SUCCESS:Registered successfully')
                         self.log_event("REGISTER", address, f"New user: {username}")
+                    else:
+                        self.send(client, 'ERROR:Username already exists')
 
                 elif command == 'LOGIN':
                     if len(parts) < 2:
-                        client.send('ERROR:Invalid command format'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid command format')
                         continue
 
                     credentials = parts[1].split(':', 1)
                     if len(credentials) < 2:
-                        client.send('ERROR:Invalid data format'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid data format')
                         continue
 
                     username, password = credentials
@@ -119,48 +268,51 @@ class Server:
                     hashed_pw = self.hash_password(password)
                     if user and user['password'] == hashed_pw:
                         current_user = username
+                        session['user'] = username
+                        session['resumed'] = False
+                        session['sent'] = {}
                         self.online_users[username] = client
-                        client.send(f'SUCCESS:Logged in:{user["display_name"]}'.encode('utf-8'))
+                        self.send(client, f'SUCCESS:Logged in:{user["display_name"]}')
                         self.log_event("LOGIN", address, f"User: {username}")
                         self.send_contacts(username, client)
                     else:
-                        client.send('ERROR:Invalid credentials'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid credentials')
 
                 elif command == 'FIND':
                     if len(parts) < 2:
-                        client.send('ERROR:Invalid command format'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid command format')
                         continue
 
                     target = parts[1]
                     if target in self.users:
                         status = 'ONLINE' if target in self.online_users else 'OFFLINE'
-                        client.send(f'FOUND:{self.users[target]["display_name"]}:{status}'.encode('utf-8'))
+                        self.send(client, f'FOUND:{self.users[target]["display_name"]}:{status}')
                         self.log_event("FIND", address, f"Search: {target} -> Found")
                     else:
-                        client.send('NOT_FOUND:User not found'.encode('utf-8'))
+                        self.send(client, 'NOT_FOUND:User not found')
 
                 elif command == 'INVITE':
                     if len(parts) < 2:
-                        client.send('ERROR:Invalid command format'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid command format')
                         continue
 
                     target_user = parts[1]
                     if target_user in self.online_users:
                         target_client = self.online_users[target_user]
-                        target_client.send(f'INVITE:{current_user}:{self.users[current_user]["display_name"]}'.encode('utf-8'))
-                        client.send('INVITE_SENT:Request sent'.encode('utf-8'))
+                        self.send(target_client, f'INVITE:{current_user}:{self.users[current_user]["display_name"]}')
+                        self.send(client, 'INVITE_SENT:Request sent')
                         self.log_event("INVITE", address, f"From {current_user} to {target_user}")
                     else:
-                        client.send('ERROR:User offline'.encode('utf-8'))
+                        self.send(client, 'ERROR:User offline')
 
                 elif command == 'RESPONSE':
                     if len(parts) < 2:
-                        client.send('ERROR:Invalid command format'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid command format')
                         continue
 
                     response_data = parts[1].split(':', 1)
                     if len(response_data) < 2:
-                        client.send('ERROR:Invalid response format'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid response format')
                         continue
 
                     response, sender = response_data
@@ -170,15 +322,17 @@ class Server:
                         if sender in self.online_users:
                             self.active_chats[sender] = current_user
                             self.active_chats[current_user] = sender
+                            self.typing.discard((sender, current_user))
+                            self.typing.discard((current_user, sender))
 
-                            self.online_users[sender].send(f'CHAT_START:{self.users[current_user]["display_name"]}'.encode('utf-8'))
-                            client.send(f'CHAT_START:{self.users[sender]["display_name"]}'.encode('utf-8'))
+                            self.send(self.online_users[sender], f'CHAT_START:{self.users[current_user]["display_name"]}')
+                            self.send(client, f'CHAT_START:{self.users[sender]["display_name"]}')
                             self.log_event("CHAT_START", address, f"Between {current_user} and {sender}")
                         else:
-                            client.send('ERROR:User offline'.encode('utf-8'))
+                            self.send(client, 'ERROR:User offline')
                     else:
                         if sender in self.online_users:
-                            self.online_users[sender].send('REJECTED:Chat request rejected'.encode('utf-8'))
+                            self.send(self.online_users[sender], 'REJECTED:Chat request rejected')
 
                 elif command == 'MESSAGE':
                     if len(parts) < 2:
@@ -186,10 +340,37 @@ class Server:
 
                     if current_user in self.active_chats:
                         target = self.active_chats[current_user]
-                        if target in self.online_users:
-                            msg = f'MESSAGE:{self.users[current_user]["display_name"]}:{parts[1]}'
-                            self.online_users[target].send(msg.encode('utf-8'))
-                            self.log_event("MESSAGE", address, f"From {current_user} to {target}")
+                        seq = self.deliver(current_user, target, parts[1])
+                        self.log_event("MESSAGE", address, f"From {current_user} to {target}, seq {seq}")
+
+                elif command == 'ACK':
+                    if len(parts) < 2 or not current_user:
+                        continue
+
+                    ack = parts[1].rsplit(':', 1)
+                    if len(ack) < 2 or not ack[1].isdigit():
+                        continue
+
+                    self.acknowledge(ack[0], current_user, int(ack[1]))
+
+                elif command == 'RESUME':
+                    if not current_user:
+                        self.send(client, 'ERROR:Not logged in')
+                        continue
+
+                    try:
+                        state = json.loads(parts[1]) if len(parts) > 1 else {}
+                    except ValueError:
+                        self.send(client, 'ERROR:Invalid data format')
+                        continue
+
+                    if not isinstance(state, dict) or not isinstance(state.get('received', {}), dict):
+                        self.send(client, 'ERROR:Invalid data format')
+                        continue
+
+                    received = state.get('received', {}) if state.get('epoch') == self.epoch else {}
+                    resent = self.resume(current_user, client, session, received)
+                    self.log_event("RESUME", address, f"User: {current_user}, resent {resent}")
 
                 elif command == 'EXIT':
                     self.log_event("EXIT", address, f"User: {current_user}")
@@ -197,40 +378,61 @@ class Server:
 
                 elif command == 'ADD_CONTACT':
                     if len(parts) < 2:
-                        client.send('ERROR:Invalid command format'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid command format')
                         continue
 
                     contact_user = parts[1]
                     if contact_user not in self.users:
-                        client.send('ERROR:User not found'.encode('utf-8'))
+                        self.send(client, 'ERROR:User not found')
                         continue
 
                     if current_user not in self.users:
-                        client.send('ERROR:Invalid user'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid user')
                         continue
 
-                    if contact_user not in self.users[current_user]['contacts']:
-                        self.users[current_user]['contacts'].append(contact_user)
-                        self.save_users()
+                    result = self.update_contacts(current_user, [contact_user], True)[contact_user]
+                    if result == 'added':
                         self.send_contacts(current_user, client)
-                        client.send('SUCCESS:Contact added'.encode('utf-8'))
+                        self.send(client, 'SUCCESS:Contact added')
+                    elif result == 'self':
+                        self.send(client, 'ERROR:Cannot add yourself')
                     else:
-                        client.send('SUCCESS:Contact already exists'.encode('utf-8'))
+                        self.send(client, 'SUCCESS:Contact already exists')
 
                 elif command == 'REMOVE_CONTACT':
                     if len(parts) < 2:
-                        client.send('ERROR:Invalid command format'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid command format')
                         continue
 
                     contact_user = parts[1]
                     if current_user in self.users:
-                        if contact_user in self.users[current_user]['contacts']:
-                            self.users[current_user]['contacts'].remove(contact_user)
-                            self.save_users()
+                        if self.update_contacts(current_user, [contact_user], False)[contact_user] == 'removed':
                             self.send_contacts(current_user, client)
-                            client.send('SUCCESS:Contact removed'.encode('utf-8'))
+                            self.send(client, 'SUCCESS:Contact removed')
                         else:
-                            client.send('ERROR:Contact not found'.encode('utf-8'))
+                            self.send(client, 'ERROR:Contact not found')
+
+                elif command in ('ADD_CONTACTS', 'REMOVE_CONTACTS'):
+                    if len(parts) < 2:
+                        self.send(client, 'ERROR:Invalid command format')
+                        continue
+
+                    if current_user not in self.users:
+                        self.send(client, 'ERROR:Invalid user')
+                        continue
+
+                    try:
+                        usernames = json.loads(parts[1])
+                    except ValueError:
+                        usernames = None
+                    if not isinstance(usernames, list) or not all(isinstance(u, str) for u in usernames):
+                        self.send(client, 'ERROR:Invalid data format')
+                        continue
+
+                    results = self.update_contacts(current_user, usernames, command == 'ADD_CONTACTS')
+                    self.send(client, f'CONTACTS_RESULT:{json.dumps(results)}')
+                    self.send_contacts(current_user, client)
+                    self.log_event(command, address, f"User: {current_user}, {len(usernames)} items")
 
                 elif command == 'GET_CONTACTS':
                     if current_user:
@@ -238,48 +440,354 @@ class Server:
 
                 elif command == 'CHANGE_PASSWORD':
                     if len(parts) < 2:
-                        client.send('ERROR:Invalid command format'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid command format')
                         continue
 
                     passwords = parts[1].split(':', 2)
                     if len(passwords) < 3:
-                        client.send('ERROR:Invalid data format'.encode('utf-8'))
+                        self.send(client, 'ERROR:Invalid data format')
                         continue
 
                     old_password, new_password, confirm_password = passwords
                     if new_password != confirm_password:
-                        client.send('ERROR:New passwords do not match'.encode('utf-8'))
+                        self.send(client, 'ERROR:New passwords do not match')
                         continue
 
                     user = self.users.get(current_user)
                     hashed_old = self.hash_password(old_password)
                     if user and user['password'] == hashed_old:
                         hashed_new = self.hash_password(new_password)
-                        user['password'] = hashed_new
-                        self.save_users()
-                        client.send('SUCCESS:Password changed'.encode('utf-8'))
+                        with self.users_lock:
+                            user['password'] = hashed_new
+                            self.save_users()
+                        self.send(client, 'SUCCESS:Password changed')
+                    else:
+                        self.send(client, 'ERROR:Invalid old password')
+
+                elif command == 'TYPING':
+                    if len(parts) < 2 or current_user not in self.active_chats:
+                        continue
+
+                    target = self.active_chats[current_user]
+                    active = parts[1] == '1'
+                    key = (current_user, target)
+                    if (key in self.typing) == active:
+                        continue
+
+                    if active:
+                        self.typing.add(key)
                     else:
-                        client.send('ERROR:Invalid old password'.encode('utf-8'))
+                        self.typing.discard(key)
+                    if target in self.online_users:
+                        self.send(self.online_users[target], f'TYPING:{int(active)}')
 
                 elif command == 'PING':
-                    client.send('PONG:'.encode('utf-8'))
+                    tag = parts[1] if len(parts) > 1 else ''
+                    self.send(client, f'PONG:{tag}')
 
         except Exception as e:
             self.log_event("ERROR", address, f"Exception: {str(e)}")
         finally:
-            if current_user:
-                if current_user in self.online_users:
-                    del self.online_users[current_user]
-                if current_user in self.active_chats:
-                    target = self.active_chats[current_user]
+            if session['parked']:
+                with self.park_lock:
+                    if self.draining:
+                        self.parked.append((client, address, session))
+                    else:
+                        self.resume_sessions([(client, address, session)])
+                return
+            del self.sessions[client]
+            self.send_locks.pop(client, None)
+            if current_user and self.online_users.get(current_user) is client:
+                del self.online_users[current_user]
+                target = self.active_chats.pop(current_user, None)
+                if target is not None:
+                    self.active_chats.pop(target, None)
+                    self.typing.discard((current_user, target))
+                    self.typing.discard((target, current_user))
                     if target in self.online_users:
-                        self.online_users[target].send('CHAT_END:User disconnected'.encode('utf-8'))
-                    if target in self.active_chats:
-                        del self.active_chats[target]
-                    del self.active_chats[current_user]
+                        try:
+                            self.send(self.online_users[target], 'CHAT_END:User disconnected')
+                        except OSError:
+                            pass
             client.close()
             self.log_event("DISCONNECT", address, f"User: {current_user}")
 
+    def resume_sessions(self, connections):
+        for client, address, session in connections:
+            self.sessions[client] = (address, session)
+            thread = threading.Thread(target=self.handle_client, args=(client, address, session))
+            thread.start()
+
+    def start_control(self):
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.run_diagnostic('SAMPLE', PROFILE_DEFAULT_SECONDS))
+        if not hasattr(socket, 'AF_UNIX'):
+            return
+        if os.path.exists(CONTROL_SOCKET):
+            os.unlink(CONTROL_SOCKET)
+        self.control = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.control.bind(CONTROL_SOCKET)
+        os.chmod(CONTROL_SOCKET, 0o600)
+        self.control.listen()
+        thread = threading.Thread(target=self.control_loop, daemon=True)
+        thread.start()
+        if hasattr(socket, 'send_fds'):
+            signal.signal(signal.SIGUSR2, self.spawn_successor)
+
+    def spawn_successor(self, signum, frame):
+        args = [arg for arg in sys.argv if arg != '--takeover']
+        subprocess.Popen([sys.executable] + args + ['--takeover'])
+
+    def control_loop(self):
+        while True:
+            try:
+                conn, _ = self.control.accept()
+            except OSError:
+                return
+            with conn:
+                command = conn.recv(1024).decode('utf-8').strip().split()
+                if command == ['HANDOFF'] and not hasattr(socket, 'send_fds'):
+                    conn.sendall(b'ERROR:Handoff is not supported on this platform\n')
+                elif command == ['HANDOFF']:
+                    self.hand_off(conn)
+                    if self.handed_off:
+                        return
+                elif command:
+                    seconds = command[1] if len(command) > 1 else PROFILE_DEFAULT_SECONDS
+                    conn.sendall((self.run_diagnostic(command[0].upper(), seconds) + '\n').encode('utf-8'))
+
+    def run_diagnostic(self, kind, seconds):
+        jobs = {
+            'PROFILE': self.run_profile,
+            'SAMPLE': self.run_sampler,
+            'TRACEMALLOC': self.run_tracemalloc,
+            'STATE': self.dump_state,
+        }
+        if kind not in jobs:
+            return f'ERROR:Unknown command {kind}'
+        if kind in self.diagnostics:
+            return f'ERROR:{kind} already running'
+        try:
+            seconds = float(seconds)
+        except ValueError:
+            return 'ERROR:Invalid duration'
+        if not math.isfinite(seconds):
+            return 'ERROR:Invalid duration'
+        seconds = min(max(seconds, 1), PROFILE_MAX_SECONDS)
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(PROFILE_DIR, f'{kind.lower()}-{stamp}-{os.getpid()}.txt')
+
+        def job():
+            try:
+                jobs[kind](path, seconds)
+                self.log_event(kind, LOCAL_ADDRESS, f"Written to {path}")
+            except Exception as e:
+                self.log_event("ERROR", LOCAL_ADDRESS, f"{kind} failed: {str(e)}")
+            finally:
+                self.diagnostics.discard(kind)
+
+        self.diagnostics.add(kind)
+        self.log_event(kind, LOCAL_ADDRESS, f"Started for {seconds:g}s" if kind != 'STATE' else "Dumping")
+        threading.Thread(target=job, daemon=True).start()
+        return f'OK:{path}'
+
+    def sample_stacks(self, seconds):
+        me = threading.get_ident()
+        stacks = {}
+        samples = 0
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = tuple(
+                    (f.f_code.co_name, os.path.basename(f.f_code.co_filename), line)
+                    for f, line in reversed(list(traceback.walk_stack(frame)))
+                )
+                stacks[stack] = stacks.get(stack, 0) + 1
+            samples += 1
+            time.sleep(SAMPLE_INTERVAL)
+        return samples, stacks
+
+    def run_profile(self, path, seconds):
+        samples, stacks = self.sample_stacks(seconds)
+        own = {}
+        cumulative = {}
+        busy = 0
+        for stack, count in stacks.items():
+            if not any(name == 'handle_client' for name, _, _ in stack):
+                continue
+            if stack[-1][1] == 'selectors.py':
+                continue
+            busy += count
+            functions = [(name, filename) for name, filename, _ in stack]
+            own[functions[-1]] = own.get(functions[-1], 0) + count
+            for function in set(functions):
+                cumulative[function] = cumulative.get(function, 0) + count
+        with open(path, 'w') as f:
+            f.write(f"# {samples} samples every {SAMPLE_INTERVAL}s, {busy} busy handler samples\n")
+            f.write(f"{'cumulative':>10} {'own':>10}  function\n")
+            ranked = sorted(cumulative.items(), key=lambda item: -item[1])[:50]
+            for (name, filename), count in ranked:
+                f.write(f"{count:>10} {own.get((name, filename), 0):>10}  {name} ({filename})\n")
+
+    def run_sampler(self, path, seconds):
+        samples, stacks = self.sample_stacks(seconds)
+        with open(path, 'w') as f:
+            f.write(f"# {samples} samples every {SAMPLE_INTERVAL}s, collapsed stacks\n")
+            for stack, count in sorted(stacks.items(), key=lambda item: -item[1]):
+                frames = ';'.join(f'{name} ({filename}:{line})' for name, filename, line in stack)
+                f.write(f"{frames} {count}\n")
+
+    def run_tracemalloc(self, path, seconds):
+        if tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is already tracing")
+        tracemalloc.start(25)
+        try:
+            before = tracemalloc.take_snapshot()
+            time.sleep(seconds)
+            after = tracemalloc.take_snapshot()
+        finally:
+            tracemalloc.stop()
+        with open(path, 'w') as f:
+            for stat in after.compare_to(before, 'lineno')[:50]:
+                f.write(f"{stat}\n")
+
+    def dump_state(self, path, seconds):
+        with self.delivery_lock:
+            connections = []
+            for client, (address, session) in list(self.sessions.items()):
+                user = session['user']
+                windows = self.unacked.get(user, {}).values()
+                connections.append({
+                    'address': f'{address[0]}:{address[1]}',
+                    'user': user,
+                    'buffer_bytes': len(session['buffer']),
+                    'chat_partner': self.active_chats.get(user),
+                    'unacked_frames': sum(len(window) for window in windows),
+                    'unacked_bytes': sum(len(frame) for window in windows for _, frame in window),
+                    'contacts': len(self.users.get(user, {}).get('contacts', [])),
+                })
+            state = {
+                'users': len(self.users),
+                'online_users': len(self.online_users),
+                'active_chats': len(self.active_chats),
+                'typing': len(self.typing),
+                'sequences': len(self.sequences),
+                'connections': connections,
+            }
+        with open(path, 'w') as f:
+            json.dump(state, f, indent=2)
+
+    def hand_off(self, conn):
+        self.log_event("HANDOFF", LOCAL_ADDRESS, "Draining connections")
+        self.handoff_done = threading.Event()
+        self.parked = []
+        self.draining = True
+        self.drain_w.send(b'x')
+        deadline = time.time() + HANDOFF_TIMEOUT
+        self.accept_paused.wait(HANDOFF_TIMEOUT)
+        while len(self.parked) < len(self.sessions) and time.time() < deadline:
+            time.sleep(0.01)
+        parked = list(self.parked)
+        try:
+            if not self.accept_paused.is_set() or len(parked) < len(self.sessions):
+                raise OSError(f"{len(self.sessions) - len(parked)} connections did not park in time")
+            with self.delivery_lock:
+                state = {
+                    'epoch': self.epoch,
+                    'active_chats': self.active_chats,
+                    'typing': list(self.typing),
+                    'sequences': [[sender, target, seq] for (sender, target), seq in self.sequences.items()],
+                    'unacked': {
+                        target: {sender: list(window) for sender, window in windows.items()}
+                        for target, windows in self.unacked.items()
+                    },
+                    'connections': [
+                        {
+                            'address': list(address),
+                            'user': session['user'],
+                            'buffer': base64.b64encode(session['buffer']).decode('ascii'),
+                            'resumed': session['resumed'],
+                            'sent': session['sent']
+                        }
+                        for _, address, session in parked
+                    ]
+                }
+            payload = json.dumps(state).encode('utf-8')
+            conn.sendall(struct.pack('!I', len(payload)) + payload)
+            fds = [self.server.fileno()] + [client.fileno() for client, _, _ in parked]
+            for i in range(0, len(fds), 250):
+                socket.send_fds(conn, [b'F'], fds[i:i + 250])
+            if conn.recv(2) != b'OK':
+                raise OSError("Successor did not confirm handoff")
+        except Exception as e:
+            self.log_event("ERROR", LOCAL_ADDRESS, f"Handoff failed: {str(e)}")
+            with self.park_lock:
+                self.drain_r.recv(1)
+                self.draining = False
+                self.resume_sessions(self.parked)
+                self.parked = []
+            self.handoff_done.set()
+            return
+
+        self.handed_off = True
+        self.control.close()
+        for client, _, _ in parked:
+            client.close()
+        self.log_event("HANDOFF", LOCAL_ADDRESS, f"Handed off {len(parked)} connections")
+        self.handoff_done.set()
+
+    def take_over(self):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(CONTROL_SOCKET)
+        conn.sendall(b'HANDOFF\n')
+        header = self.recv_exact(conn, 4)
+        state = json.loads(self.recv_exact(conn, struct.unpack('!I', header)[0]))
+        fds = []
+        while len(fds) < len(state['connections']) + 1:
+            _, received, _, _ = socket.recv_fds(conn, 1, 250)
+            if not received:
+                raise OSError("Handoff connection closed")
+            fds.extend(received)
+
+        self.server = socket.socket(fileno=fds[0])
+        self.epoch = state['epoch']
+        self.active_chats = state['active_chats']
+        self.typing = {tuple(pair) for pair in state['typing']}
+        self.sequences = {(sender, target): seq for sender, target, seq in state['sequences']}
+        self.unacked = {
+            target: {
+                sender: deque((tuple(item) for item in window), maxlen=UNACKED_WINDOW)
+                for sender, window in windows.items()
+            }
+            for target, windows in state['unacked'].items()
+        }
+        for fd, info in zip(fds[1:], state['connections']):
+            client = socket.socket(fileno=fd)
+            session = {
+                'user': info['user'],
+                'buffer': base64.b64decode(info['buffer']),
+                'resumed': info['resumed'],
+                'sent': info['sent']
+            }
+            if session['user']:
+                self.online_users[session['user']] = client
+            self.restored.append((client, tuple(info['address']), session))
+        conn.sendall(b'OK')
+        conn.close()
+
+    def recv_exact(self, conn, size):
+        data = b''
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                raise OSError("Handoff connection closed")
+            data += chunk
+        return data
+
     def start(self):
         print(f"╔{'═' * 60}╗")
         print(f"║{'СЕРВЕР ЗАПУЩЕН':^60}║")
@@ -287,13 +795,38 @@ class Server:
         print(f"║ Публичный IP: {HOST:<45}║")
         print(f"║ Порт: {PORT:<53}║")
         print(f"╚{'═' * 60}╝\n")
+        self.start_control()
+        if self.restored:
+            self.log_event("HANDOFF", LOCAL_ADDRESS, f"Took over {len(self.restored)} connections")
+            self.resume_sessions(self.restored)
         print("Ожидание подключений...")
+        selector = Selector()
+        selector.register(self.server, selectors.EVENT_READ)
+        selector.register(self.drain_r, selectors.EVENT_READ)
         while True:
+            selector.select()
+            if self.draining:
+                self.accept_paused.set()
+                self.handoff_done.wait()
+                self.accept_paused.clear()
+                if self.handed_off:
+                    self.server.close()
+                    return
+                continue
             client, address = self.server.accept()
             self.log_event("CONNECT", address, "New connection")
-            thread = threading.Thread(target=self.handle_client, args=(client, address))
-            thread.start()
+            self.resume_sessions([(client, address, {'user': None, 'buffer': b'', 'resumed': False, 'sent': {}})])
+
+def admin(command):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(CONTROL_SOCKET)
+    conn.sendall((' '.join(command) + '\n').encode('utf-8'))
+    print(conn.recv(1024).decode('utf-8').strip())
+    conn.close()
 
 if __name__ == "__main__":
-    server = Server()
-    server.start()
\ No newline at end of file
+    if '--admin' in sys.argv:
+        admin(sys.argv[sys.argv.index('--admin') + 1:])
+    else:
+        server = Server(takeover='--takeover' in sys.argv)
+        server.start()
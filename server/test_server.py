@@ -0,0 +1,237 @@
+import json
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import server
+from server import Server
+
+
+class Peer:
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.settimeout(5)
+        self.file = sock.makefile('r', encoding='utf-8', newline='\n')
+
+    def send(self, message):
+        self.sock.sendall((message + '\n').encode('utf-8'))
+
+    def read_until(self, prefix):
+        lines = []
+        while True:
+            line = self.file.readline()
+            if not line:
+                raise ConnectionError('connection closed')
+            lines.append(line.rstrip('\n'))
+            if lines[-1].startswith(prefix):
+                return lines
+
+    def sync(self, tag='sync'):
+        self.send(f'PING:{tag}')
+        return self.read_until(f'PONG:{tag}')[:-1]
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self):
+        threads = set(threading.enumerate())
+        self.addCleanup(self.join_handlers, threads)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.users_file = os.path.join(tmp.name, 'users.json')
+        for name, value in (('USERS_FILE', self.users_file),
+                            ('SALT_FILE', os.path.join(tmp.name, 'server.salt'))):
+            patcher = mock.patch.object(server, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.server = Server(bind=False)
+        self.addCleanup(self.server.drain_r.close)
+        self.addCleanup(self.server.drain_w.close)
+        self.server.log_event = lambda *args: None
+
+    def join_handlers(self, threads):
+        for thread in set(threading.enumerate()) - threads:
+            if not thread.daemon:
+                thread.join(5)
+
+    def connect(self):
+        client, peer = socket.socketpair()
+        session = {'user': None, 'buffer': b'', 'resumed': False, 'sent': {}}
+        self.server.resume_sessions([(client, ('test', peer.fileno()), session)])
+        peer = Peer(peer)
+        self.addCleanup(peer.close)
+        return peer
+
+    def login(self, username, password='pw'):
+        peer = self.connect()
+        peer.send(f'LOGIN:{username}:{password}')
+        peer.read_until('CONTACTS:')
+        return peer
+
+    def add_user(self, username, *contacts):
+        self.server.users[username] = {
+            'password': self.server.hash_password('pw'),
+            'display_name': username.title(),
+            'contacts': set(contacts)
+        }
+
+    def saved_contacts(self, username):
+        with open(self.users_file) as f:
+            return json.load(f)[username]['contacts']
+
+
+class ContactsTest(ServerTestCase):
+    def test_bulk_add_reports_each_name(self):
+        for username in ('alice', 'bob', 'carol'):
+            self.add_user(username)
+        self.server.users['alice']['contacts'].add('carol')
+        results = self.server.update_contacts('alice', ['bob', 'carol', 'alice', 'zed'], True)
+        self.assertEqual(results, {'bob': 'added', 'carol': 'exists', 'alice': 'self', 'zed': 'not_found'})
+        self.assertEqual(self.saved_contacts('alice'), ['bob', 'carol'])
+
+    def test_duplicate_names_are_saved(self):
+        self.add_user('alice')
+        self.add_user('bob')
+        self.assertEqual(self.server.update_contacts('alice', ['bob', 'bob'], True), {'bob': 'added'})
+        self.assertEqual(self.saved_contacts('alice'), ['bob'])
+        self.assertEqual(self.server.update_contacts('alice', ['bob', 'bob'], False), {'bob': 'removed'})
+        self.assertEqual(self.saved_contacts('alice'), [])
+
+    def test_unchanged_contacts_are_not_saved(self):
+        self.add_user('alice', 'bob')
+        self.add_user('bob')
+        self.assertEqual(self.server.update_contacts('alice', ['bob'], True), {'bob': 'exists'})
+        self.assertFalse(os.path.exists(self.users_file))
+
+
+class SessionTest(ServerTestCase):
+    def test_login_on_resumed_connection_waits_for_resume(self):
+        for username in ('alice', 'bob', 'carol'):
+            self.add_user(username)
+        peer = self.login('alice')
+        peer.send('RESUME:{}')
+        peer.read_until('RESUMED:')
+        peer.send('LOGIN:bob:pw')
+        peer.read_until('CONTACTS:')
+        self.server.deliver('carol', 'bob', 'hi')
+        self.assertEqual(peer.sync(), [])
+        peer.send('RESUME:{}')
+        lines = peer.read_until('MESSAGE:')
+        self.assertEqual(lines[-1], 'MESSAGE:carol:1:Carol:hi')
+
+
+
+class DeliveryTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        for username in ('alice', 'bob', 'carol'):
+            self.add_user(username)
+
+    def resume(self, peer, epoch=None, **received):
+        peer.send('RESUME:' + json.dumps({'epoch': epoch, 'received': received}))
+        return peer.read_until('RESUMED:')[-1].split(':', 1)[1]
+
+    def messages(self, peer):
+        return [line for line in peer.sync() if line.startswith('MESSAGE:')]
+
+    def test_window_is_trimmed_and_acknowledged(self):
+        with mock.patch.object(server, 'UNACKED_WINDOW', 3):
+            for n in range(5):
+                self.server.deliver('carol', 'bob', f'm{n}')
+        window = self.server.unacked['bob']['carol']
+        self.assertEqual([seq for seq, frame in window], [3, 4, 5])
+        self.server.acknowledge('carol', 'bob', 4)
+        self.assertEqual([seq for seq, frame in window], [5])
+        self.server.acknowledge('carol', 'bob', 5)
+        self.assertEqual(self.server.unacked['bob'], {})
+
+    def test_frames_wait_for_resume(self):
+        peer = self.login('bob')
+        self.server.deliver('carol', 'bob', 'hi')
+        self.assertEqual(self.messages(peer), [])
+        self.resume(peer)
+        self.assertEqual(self.messages(peer), ['MESSAGE:carol:1:Carol:hi'])
+        self.server.deliver('carol', 'bob', 'again')
+        self.assertEqual(self.messages(peer), ['MESSAGE:carol:2:Carol:again'])
+
+    def test_resume_resends_only_the_gap(self):
+        peer = self.login('bob')
+        epoch = self.resume(peer)
+        for n in range(3):
+            self.server.deliver('carol', 'bob', f'm{n}')
+        self.assertEqual(len(self.messages(peer)), 3)
+        peer.send('ACK:carol:1')
+        peer = self.login('bob')
+        self.resume(peer, epoch, carol=2)
+        self.assertEqual(self.messages(peer), ['MESSAGE:carol:3:Carol:m2'])
+        self.assertEqual([seq for seq, frame in self.server.unacked['bob']['carol']], [3])
+
+    def test_resume_with_stale_epoch_resends_everything(self):
+        for n in range(3):
+            self.server.deliver('carol', 'bob', f'm{n}')
+        peer = self.login('bob')
+        self.resume(peer, 'stale', carol=3)
+        self.assertEqual(len(self.messages(peer)), 3)
+        self.assertEqual(len(self.server.unacked['bob']['carol']), 3)
+
+    def test_chat_messages_are_sequenced(self):
+        alice, bob = self.login('alice'), self.login('bob')
+        self.resume(bob)
+        self.server.active_chats.update({'alice': 'bob', 'bob': 'alice'})
+        alice.send('MESSAGE:a:b')
+        alice.send('MESSAGE:c')
+        alice.sync()
+        self.assertEqual(self.messages(bob), ['MESSAGE:alice:1:Alice:a:b', 'MESSAGE:alice:2:Alice:c'])
+
+    def test_state_dump_counts_unacked_frames(self):
+        self.login('bob')
+        for n in range(3):
+            self.server.deliver('carol', 'bob', 'hi')
+        path = os.path.join(os.path.dirname(self.users_file), 'state.json')
+        self.server.dump_state(path, 0)
+        with open(path) as f:
+            state = json.load(f)
+        self.assertEqual(state['sequences'], 1)
+        [connection] = state['connections']
+        self.assertEqual(connection['user'], 'bob')
+        self.assertEqual(connection['unacked_frames'], 3)
+        self.assertEqual(connection['unacked_bytes'], 3 * len('MESSAGE:carol:1:Carol:hi'))
+
+
+class TypingTest(ServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_user('alice')
+        self.add_user('bob')
+        self.alice, self.bob = self.login('alice'), self.login('bob')
+
+    def test_relay_drops_repeats(self):
+        self.server.active_chats.update({'alice': 'bob', 'bob': 'alice'})
+        for state in ('1', '1', '1', '0', '0', '1'):
+            self.alice.send(f'TYPING:{state}')
+        self.alice.sync()
+        self.assertEqual(self.bob.sync(), ['TYPING:1', 'TYPING:0', 'TYPING:1'])
+
+    def test_no_relay_outside_chat(self):
+        self.alice.send('TYPING:1')
+        self.alice.sync()
+        self.assertEqual(self.bob.sync(), [])
+        self.assertEqual(self.server.typing, set())
+
+    def test_chat_end_clears_typing(self):
+        self.server.active_chats.update({'alice': 'bob', 'bob': 'alice'})
+        self.alice.send('TYPING:1')
+        self.alice.sync()
+        self.alice.close()
+        self.assertEqual(self.bob.read_until('CHAT_END:'), ['TYPING:1', 'CHAT_END:User disconnected'])
+        self.assertEqual(self.server.typing, set())
+
+
+if __name__ == '__main__':
+    unittest.main()